@@ -1,7 +1,9 @@
 import networkx as nx
+import numpy as np
+from numba import njit, prange
 from parse import read_input_file, write_output_file
 from utils import is_valid_solution, calculate_happiness, \
-    calculate_stress_for_room, calculate_happiness_for_room
+    calculate_stress_for_room
 import sys
 import random
 import glob
@@ -9,6 +11,13 @@ from random import sample
 from os.path import basename, normpath
 from math import ceil, exp
 
+# Room stress is summed in a different order than the output validator in
+# utils, so a room whose stress lands exactly on its budget can come out
+# slightly over it on either side. Rooms within this margin of their budget
+# are accepted by the neighborhoods and rescored in the validator's order
+# before a change is applied, see is_valid_change.
+STRESS_TOLERANCE = 1e-9
+
 def solve(G, s):
     """
     Args:
@@ -27,10 +36,81 @@ def solve(G, s):
         ensure a solution T that approximates the optimal solution T'.
     """
 
+    S, H = create_adjacency_matrices(G)
     initial_solution, k = create_initial_mapping(G, s)
-    D, k = seqVND(G, s, initial_solution, k)
+    D, k = seqVND(G, S, H, s, initial_solution, k)
+
+    return dict(enumerate(D.tolist())), k
+
+
+def create_adjacency_matrices(G):
+    """
+    Args:
+        G: networkx.Graph
+    Returns:
+        S: Matrix where S[i, j] is the stress students i and j induce on
+        each other
+        H: Matrix where H[i, j] is the happiness students i and j give
+        each other
+    Notes:
+        This function converts the graph into dense matrices once so rooms
+        can be scored with array reductions instead of graph lookups.
+    """
+
+    num_students = len(G.nodes())
+    S = np.zeros((num_students, num_students))
+    H = np.zeros_like(S)
+
+    for u, v, data in G.edges(data=True):
+        S[u, v] = S[v, u] = data['stress']
+        H[u, v] = H[v, u] = data['happiness']
+
+    return S, H
+
+
+@njit(cache=True, nogil=True)
+def room_pair_sum(members, M):
+    """
+    Args:
+        members: Array of students in a room
+        M: Stress or happiness matrix
+    Returns:
+        float: Sum of M over every pair of students in the room
+    """
+
+    total = 0.0
+    num_members = members.shape[0]
+    for i in range(num_members):
+        for j in range(i + 1, num_members):
+            total += M[members[i], members[j]]
+
+    return total
+
+
+@njit(cache=True, nogil=True)
+def stress_room(members, S):
+    """
+    Args:
+        members: Array of students in a room
+        S: Stress matrix
+    Returns:
+        float: Stress value of the room
+    """
+
+    return room_pair_sum(members, S)
 
-    return D, k
+
+@njit(cache=True, nogil=True)
+def happiness_room(members, H):
+    """
+    Args:
+        members: Array of students in a room
+        H: Happiness matrix
+    Returns:
+        float: Happiness value of the room
+    """
+
+    return room_pair_sum(members, H)
 
 
 def create_initial_mapping(G, s):
@@ -39,8 +119,8 @@ def create_initial_mapping(G, s):
         G: networkx.Graph
         s: stress_budget
     Returns:
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         k: Number of breakout rooms
     Notes:
         This function greedily chooses an initial solution to the problem by
@@ -48,44 +128,51 @@ def create_initial_mapping(G, s):
     """
 
     num_students = len(G.nodes())
-    D = {}
-    k = num_students
+    D = np.empty(num_students, dtype=np.int32)
+    placed = np.zeros(num_students, dtype=bool)
 
     # Sort all edges by increasing stress value.
-    edges_by_stress= sorted(G.edges(data=True), key=lambda t: t[2].get(
-        'stress', 1))
+    edges = np.fromiter(((u, v, data.get('stress', 1))
+                         for u, v, data in G.edges(data=True)),
+                        dtype=[('u', 'i4'), ('v', 'i4'), ('s', 'f8')],
+                        count=G.number_of_edges())
+    edges_by_stress = edges[np.argsort(edges['s'], kind='stable')]
 
     # Place pairs of students into their own room if they have a low enough
     # stress value.
     room_counter = 0
-    for edge in edges_by_stress:
-        if edge[0] not in D and edge[1] not in D:
-            if edge[2].get('stress') <= (s / num_students):
-                D[edge[0]] = room_counter
-                D[edge[1]] = room_counter
+    max_stress = s / num_students
+    for u, v, stress in edges_by_stress.tolist():
+        if not placed[u] and not placed[v]:
+            if stress <= max_stress:
+                D[u] = room_counter
+                D[v] = room_counter
+                placed[u] = placed[v] = True
                 room_counter += 1
 
     # Loop through the students and place them into their own breakout room
     # if they weren't placed in one previously.
     for i in range(num_students):
-        if i not in D:
+        if not placed[i]:
             D[i] = room_counter
             room_counter += 1
 
-    return D, k
+    return D, room_counter
 
 
-def seqVND(G, s, D, k):
+def seqVND(G, S, H, s, D, k):
     """
     Args:
         G: networkx.Graph
+        S: Stress matrix
+        H: Happiness matrix
         s: stress_budget
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         k: Number of breakout rooms
     Returns:
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         k: Number of breakout rooms
     Notes:
         This function perfroms Sequential Variable Neighborhood Descent
@@ -96,8 +183,13 @@ def seqVND(G, s, D, k):
         concurrent two person moves.
     """
 
-    # Store the current happiness rating
-    curr_happiness_rating = calculate_happiness(D, G)
+    # Store the current happiness rating, each student's happiness
+    # contribution to every room and the students, size and stress of every
+    # room.
+    curr_happiness_rating = mapping_happiness(D, H)
+    contrib = happiness_contributions(D, H)
+    candidate_rooms = improving_rooms(D, contrib)
+    room_to_s, room_sizes, room_stress_sum = room_arrays(D, S)
 
     # Initialize our neighborhood variables
     total_neighborhoods = 3
@@ -106,18 +198,37 @@ def seqVND(G, s, D, k):
     # Perform Sequential Varaible Neighborhood Descent
     while current_neighborhood <= total_neighborhoods:
         if current_neighborhood == 1:
-            potential_changes = move_neighborhood(G, s, D, k)
-            best_neighborhood_change, best_neighborhood_happiness = local_search_move(D, G, potential_changes)
+            potential_changes = move_neighborhood(S, s, D, room_to_s,
+                                                  room_sizes,
+                                                  room_stress_sum, k,
+                                                  candidate_rooms)
+            best_neighborhood_change, best_neighborhood_happiness = \
+                local_search_move(D, H, potential_changes, contrib,
+                                  curr_happiness_rating, S, G, s)
         elif current_neighborhood == 2:
-            potential_changes = swap_neighborhood(G, s, D, k)
-            best_neighborhood_change, best_neighborhood_happiness = local_search_swap(D, G, potential_changes)
+            potential_changes = swap_neighborhood(S, s, D, room_to_s,
+                                                  room_sizes,
+                                                  room_stress_sum, k)
+            best_neighborhood_change, best_neighborhood_happiness = \
+                local_search_swap(D, H, potential_changes, contrib,
+                                  curr_happiness_rating, S, G, s)
         else:
-            potential_changes = move2_neighborhood(G, s, D, k)
-            best_neighborhood_change, best_neighborhood_happiness = local_search_move2(D, G, potential_changes)
+            potential_changes = move2_neighborhood(S, s, D, room_to_s,
+                                                   room_sizes,
+                                                   room_stress_sum, k,
+                                                   candidate_rooms, H)
+            best_neighborhood_change, best_neighborhood_happiness = \
+                local_search_move2(D, H, potential_changes, contrib,
+                                   curr_happiness_rating, S, G, s)
         if best_neighborhood_happiness > curr_happiness_rating:
-            D = best_neighborhood_change
-            k = len(set(D.values()))
-            curr_happiness_rating = calculate_happiness(D, G)
+            for student in np.nonzero(best_neighborhood_change != D)[0]:
+                k += relocate_student(student,
+                                      best_neighborhood_change[student], D,
+                                      room_to_s, room_sizes, room_stress_sum,
+                                      S)
+            curr_happiness_rating = best_neighborhood_happiness
+            contrib = happiness_contributions(D, H)
+            candidate_rooms = improving_rooms(D, contrib)
             current_neighborhood = 1
         else:
             current_neighborhood += 1
@@ -125,135 +236,443 @@ def seqVND(G, s, D, k):
     return D, k
 
 
-def local_search_move(D, G, potential_changes):
+def mapping_happiness(D, H):
     """
     Args:
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+    Returns:
+        float: total happiness of the mapping
+    """
+
+    return sum(happiness_room(np.nonzero(D == room)[0], H)
+               for room in np.unique(D))
+
+
+def happiness_contributions(D, H):
+    """
+    Args:
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+    Returns:
+        contrib: Matrix where contrib[i, r] is the happiness student i
+        shares with the other students in breakout room r
+    Notes:
+        This function precomputes how much happiness each student would
+        share with every room so the local searches can score a change by
+        looking only at the students it affects.
+    """
+
+    num_students = H.shape[0]
+    membership = np.zeros((num_students, num_students))
+    membership[np.arange(num_students), D] = 1
+
+    return H @ membership
+
+
+def improving_rooms(D, contrib):
+    """
+    Args:
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        contrib: Matrix of the happiness each student shares with each
+        room.
+    Returns:
+        candidate_rooms: Boolean matrix where candidate_rooms[i, r] is
+        whether student i shares more happiness with room r than with their
+        current room
+    Notes:
+        A student can only increase the happiness by moving into one of
+        their candidate rooms, so the neighborhoods skip the other rooms
+        without checking their stress.
+    """
+
+    num_students = D.shape[0]
+
+    return contrib > contrib[np.arange(num_students), D][:, None]
+
+
+def room_arrays(D, S):
+    """
+    Args:
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        S: Stress matrix
+    Returns:
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+    Notes:
+        This function builds the per room arrays used by the compiled
+        validity checks and neighborhoods. seqVND keeps them up to date with
+        relocate_student rather than rebuilding them.
+    """
+
+    num_students = S.shape[0]
+    room_to_s = np.empty((num_students, num_students), dtype=np.int32)
+    room_sizes = np.zeros(num_students, dtype=np.int32)
+    room_stress_sum = np.zeros(num_students)
+
+    for room in np.unique(D):
+        members = np.nonzero(D == room)[0]
+        room_to_s[room, :len(members)] = members
+        room_sizes[room] = len(members)
+        room_stress_sum[room] = stress_room(members, S)
+
+    return room_to_s, room_sizes, room_stress_sum
+
+
+def move_delta(student, room, D, contrib):
+    """
+    Args:
+        student: the student to be moved
+        room: the room the student will be moved into
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        contrib: Matrix of the happiness each student shares with each
+        room.
+    Returns:
+        float: change in total happiness if the student is moved
+    """
+
+    return contrib[student, room] - contrib[student, D[student]]
+
+
+def move2_delta(student1, student2, room1, room2, D, H, contrib):
+    """
+    Args:
+        student1: the first student to be moved
+        student2: the second student to be moved
+        room1: the room the first student will be moved into
+        room2: the room the second student will be moved into
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+        contrib: Matrix of the happiness each student shares with each
+        room.
+    Returns:
+        float: change in total happiness if both students are moved
+    Notes:
+        The individual deltas of two students moved at the same time count
+        the edge between them using each other's old rooms, so the edge is
+        corrected to match the new mapping.
+    """
+
+    delta = move_delta(student1, room1, D, contrib) \
+        + move_delta(student2, room2, D, contrib)
+
+    correction = int(room1 == room2) + int(D[student1] == D[student2]) \
+        - int(room1 == D[student2]) - int(room2 == D[student1])
+    if correction != 0:
+        delta += correction * H[student1, student2]
+
+    return delta
+
+
+def swap_delta(student1, student2, D, H, contrib):
+    """
+    Args:
+        student1: the first student to be swapped
+        student2: the second student to be swapped
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+        contrib: Matrix of the happiness each student shares with each
+        room.
+    Returns:
+        float: change in total happiness if the students are swapped
+    """
+
+    return move2_delta(student1, student2, D[student2], D[student1], D, H,
+                       contrib)
+
+
+def is_valid_change(D, change, S, G, s):
+    """
+    Args:
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        change: Array mapping for student to breakout room r after the
+        change is applied
+        S: Stress matrix
         G: networkx.Graph
-        potential_changes: 2D List of all potential moves.
+        s: stress_budget
     Returns:
-        best_change: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        bool: whether every room the change touches is within the stress
+        budget as the output validator computes it
+    Notes:
+        The neighborhoods accept rooms up to STRESS_TOLERANCE over their
+        budget, so that a room landing exactly on it is not lost to rounding.
+        Only those rooms are rescored here, in the validator's order. The
+        number of rooms never grows, so the rooms the change does not touch
+        stay within their budget.
+    """
+
+    moved = np.nonzero(change != D)[0]
+    budget = s / len(set(change.tolist()))
+    for room in set(D[moved].tolist()) | set(change[moved].tolist()):
+        members = np.nonzero(change == room)[0]
+        if stress_room(members, S) <= budget - STRESS_TOLERANCE:
+            continue
+        if calculate_stress_for_room(members.tolist(), G) > budget:
+            return False
+
+    return True
+
+
+def local_search_move(D, H, potential_changes, contrib, happiness, S, G, s):
+    """
+    Args:
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+        potential_changes: Array of all potential moves, one
+        [student, room] row per move.
+        contrib: Matrix of the happiness each student shares with each
+        room.
+        happiness: Happiness value of D
+        S: Stress matrix
+        G: networkx.Graph
+        s: stress_budget
+    Returns:
+        best_change: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         best_happiness: Correspond happiness value for best_change
     Notes:
         This function will perform a local search of all potential moves,
         applying the optimal move, and returning the correspond mapping
-        and happiness rating.
+        and happiness rating. Moves are tried from the best down until one
+        passes is_valid_change.
     """
 
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
-
-    best_change = D.copy()
-    best_happiness = 0
-    best_move = []
+    deltas = np.empty(potential_changes.shape[0])
+    for r in range(potential_changes.shape[0]):
+        student, room = potential_changes[r, 0], potential_changes[r, 1]
+        deltas[r] = move_delta(student, room, D, contrib)
 
-    for change in potential_changes:
-        move(change[0], change[1], best_change)
-        change_happiness = calculate_happiness(best_change, G)
-        if change_happiness > best_happiness:
-            best_happiness = change_happiness
-            best_move = change
-        move(change[0], D[change[0]], best_change)
-    if len(best_move) > 0:
-        move(best_move[0], best_move[1], best_change)
+    for r in np.argsort(-deltas, kind='stable'):
+        if deltas[r] <= 0:
+            break
+        best_change = np.copy(D)
+        move(potential_changes[r, 0], potential_changes[r, 1], best_change)
+        if is_valid_change(D, best_change, S, G, s):
+            return best_change, happiness + deltas[r]
 
-    return best_change, best_happiness
+    return D, happiness
 
 
-def local_search_swap(D, G, potential_changes):
+def local_search_swap(D, H, potential_changes, contrib, happiness, S, G, s):
     """
     Args:
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+        potential_changes: Array of all potential swaps, one
+        [student1, student2] row per swap.
+        contrib: Matrix of the happiness each student shares with each
+        room.
+        happiness: Happiness value of D
+        S: Stress matrix
         G: networkx.Graph
-        potential_changes: 2D List of all potential moves.
+        s: stress_budget
     Returns:
-        best_change: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        best_change: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         best_happiness: Correspond happiness value for best_change
     Notes:
         This function will perform a local search of all potential swaps,
         applying the optimal swap, and returning the correspond mapping
-        and happiness rating.
+        and happiness rating. Swaps are tried from the best down until one
+        passes is_valid_change.
     """
 
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
+    deltas = np.empty(potential_changes.shape[0])
+    for r in range(potential_changes.shape[0]):
+        student1, student2 = potential_changes[r, 0], potential_changes[r, 1]
+        deltas[r] = swap_delta(student1, student2, D, H, contrib)
 
-    best_change = D.copy()
-    best_happiness = 0
-    best_swap = []
+    for r in np.argsort(-deltas, kind='stable'):
+        if deltas[r] <= 0:
+            break
+        best_change = np.copy(D)
+        swap(potential_changes[r, 0], potential_changes[r, 1], best_change)
+        if is_valid_change(D, best_change, S, G, s):
+            return best_change, happiness + deltas[r]
 
-    for change in potential_changes:
-        student1, student2 = change[0], change[1]
-        swap(student1, student2, best_change)
-        change_happiness = calculate_happiness(best_change, G)
-        if change_happiness > best_happiness:
-            best_happiness = change_happiness
-            best_swap = change
-        swap(student1, student2, best_change)
-    if len(best_swap) > 0:
-        swap(best_swap[0], best_swap[1], best_change)
+    return D, happiness
 
-    return best_change, best_happiness
-
-def local_search_move2(D, G, potential_changes):
+def local_search_move2(D, H, potential_changes, contrib, happiness, S, G, s):
     """
     Args:
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
+        H: Happiness matrix
+        potential_changes: Iterable of arrays of potential two student
+        moves, one [student1, room1, student2, room2] row per move.
+        contrib: Matrix of the happiness each student shares with each
+        room.
+        happiness: Happiness value of D
+        S: Stress matrix
         G: networkx.Graph
-        potential_changes: 2D List of all potential moves.
+        s: stress_budget
     Returns:
-        best_change: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        best_change: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
         best_happiness: Correspond happiness value for best_change
     Notes:
-        This function will perform a local search of all potential two
-        student moves, applying the optimal move, and returning the
-        correspond mapping and happiness rating.
+        This function will perform a first improvement local search of the
+        potential two student moves, applying the first move which increases
+        the happiness, and returning the correspond mapping and happiness
+        rating. The two student neighborhood is by far the largest, so the
+        remaining moves are never generated once an improvement is found.
     """
 
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
+    for changes in potential_changes:
+        for r in range(changes.shape[0]):
+            student1, room1 = changes[r, 0], changes[r, 1]
+            student2, room2 = changes[r, 2], changes[r, 3]
+            delta = move2_delta(student1, student2, room1, room2, D, H,
+                                contrib)
+            if delta > 0:
+                best_change = np.copy(D)
+                move2(student1, student2, room1, room2, best_change)
+                if is_valid_change(D, best_change, S, G, s):
+                    return best_change, happiness + delta
+
+    return D, happiness
+
+@njit(cache=True)
+def room_join_stress(student, room, room_to_s, room_sizes, S, budget):
+    """
+    Args:
+        student: the student joining the room
+        room: the room the student joins
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        S: Stress matrix
+        budget: stress the student may add before the room is invalid
+    Returns:
+        float: stress the student adds to the room's current members
+    Notes:
+        Stress values are never negative, so the sum stops as soon as it
+        exceeds the budget and the partial sum is returned instead. Most
+        rooms hold at most a few students, so rooms of up to four students
+        are summed directly. A student shares no stress with themself, so
+        the direct sums need not skip them.
+    """
+
+    num_members = room_sizes[room]
+    stress_row = S[student]
+    members = room_to_s[room]
+    if num_members == 0:
+        return 0.0
+    if num_members == 1:
+        return stress_row[members[0]]
+    if num_members == 2:
+        return stress_row[members[0]] + stress_row[members[1]]
+    if num_members == 3:
+        return (stress_row[members[0]] + stress_row[members[1]]
+                + stress_row[members[2]])
+    if num_members == 4:
+        return (stress_row[members[0]] + stress_row[members[1]]
+                + stress_row[members[2]] + stress_row[members[3]])
+
+    stress = 0.0
+    for i in range(num_members):
+        other = room_to_s[room, i]
+        if other != student:
+            stress += S[student, other]
+            if stress > budget:
+                return stress
+
+    return stress
+
+
+@njit(cache=True)
+def relocate_student(student, room, room_of, room_to_s, room_sizes,
+                     room_stress_sum, S):
+    """
+    Args:
+        student: the student to be moved
+        room: the room the student will be moved into
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+        S: Stress matrix
+    Returns:
+        int: change in the number of breakout rooms in use
+    Notes:
+        This function moves a student in the array view of a mapping,
+        updating only the two rooms involved.
+    """
+
+    rooms_delta = 0
+
+    # Remove the student from their current room by moving the room's last
+    # student into their slot.
+    student_room = room_of[student]
+    room_stress_sum[student_room] -= room_join_stress(
+        student, student_room, room_to_s, room_sizes, S, np.inf)
+    last = room_sizes[student_room] - 1
+    for i in range(last + 1):
+        if room_to_s[student_room, i] == student:
+            room_to_s[student_room, i] = room_to_s[student_room, last]
+            break
+    room_sizes[student_room] -= 1
+    if room_sizes[student_room] == 0:
+        rooms_delta -= 1
+
+    # Add the student to the end of the new room.
+    room_of[student] = room
+    room_stress_sum[room] += room_join_stress(student, room, room_to_s,
+                                              room_sizes, S, np.inf)
+    room_to_s[room, room_sizes[room]] = student
+    if room_sizes[room] == 0:
+        rooms_delta += 1
+    room_sizes[room] += 1
+
+    return rooms_delta
+
+
+@njit(cache=True)
+def stress_threshold(s, k):
+    """
+    Args:
+        s: stress budget
+        k: number of breakout rooms
+    Returns:
+        float: the most stress allowed in each room with k rooms open, up
+        to STRESS_TOLERANCE over the budget
+    """
 
-    best_change = D.copy()
-    best_happiness = 0
-    best_move = []
+    if k <= 0:
+        return np.inf
 
-    for change in potential_changes:
-        move2(change[0][0], change[1][0], change[0][1], change[1][1],
-              best_change)
-        change_happiness = calculate_happiness(best_change, G)
-        if change_happiness > best_happiness:
-            best_happiness = change_happiness
-            best_move = change
-        move2(change[0][0], change[1][0], D[change[0][0]], D[change[1][0]],
-              best_change)
-    if len(best_move) > 0:
-        move2(change[0][0], change[1][0], change[0][1], change[1][1],
-              best_change)
+    return s / k + STRESS_TOLERANCE
 
-    return best_change, best_happiness
 
-def is_valid_swap(student1, student2, D, rooms_to_s, k, G, s):
+@njit(cache=True)
+def is_valid_swap(student1, student2, room_of, room_to_s, room_sizes,
+                  room_stress_sum, S, thresh):
 
     """
     Args:
         student1: the first student
         student2: the second student
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
-        rooms_to_s: Dictionary mapping breakout room to a list of
-        students currently in that room e.g. {0:[1, 2], 1:[0, 3]}
-        k: number of breakout rooms
-        G: networkx.Graph
-        s: stress budget
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+        S: Stress matrix
+        thresh: the most stress allowed in each room with the current
+        number of breakout rooms
     Returns:
         bool: whether we can swap the students' breakout rooms
     Notes:
@@ -261,8 +680,12 @@ def is_valid_swap(student1, student2, D, rooms_to_s, k, G, s):
         stress guidelines
     """
 
+    # Check if we are trying to swap a student with himself.
+    if student1 == student2:
+        return False
+
     # Store the students' current rooms.
-    student_one_room, student_two_room = D[student1], D[student2]
+    student_one_room, student_two_room = room_of[student1], room_of[student2]
 
     # Check if the students are already in the same room.
     if student_one_room == student_two_room:
@@ -270,48 +693,50 @@ def is_valid_swap(student1, student2, D, rooms_to_s, k, G, s):
 
     # Check if both students are currently alone (thus a swap will not change
     # the happiness or stress and is irrelevant).
-    if len(rooms_to_s[student_one_room]) == 0 and len(rooms_to_s[
-                                                          student_two_room]) == 0:
+    if room_sizes[student_one_room] == 1 and room_sizes[student_two_room] == 1:
         return False
 
-
-    # Move the first student into a copy of the second student's room,
-    # excluding the second student.
-    student_one_moved = rooms_to_s[student_two_room].copy()
-    student_one_moved.remove(student2)
-    student_one_moved.append(student1)
-
-    # Move the second student into a copy of the first student's room,
-    # excluding the first student.
-    student_two_moved = rooms_to_s[student_one_room].copy()
-    student_two_moved.remove(student1)
-    student_two_moved.append(student2)
-
-    # Store the stress guideline.
-    max_stress = s/k
-
-    # Check if swapping the students was valid.
-    if calculate_stress_for_room(student_one_moved, G) > max_stress:
+    # Check if the first student fits in the second student's room once the
+    # second student leaves it.
+    headroom = thresh - room_stress_sum[student_two_room] \
+        + room_join_stress(student2, student_two_room, room_to_s, room_sizes,
+                           S, np.inf) \
+        + S[student1, student2]
+    if room_join_stress(student1, student_two_room, room_to_s, room_sizes, S,
+                        headroom) > headroom:
         return False
-    if calculate_stress_for_room(student_two_moved, G) > max_stress:
+
+    # Check if the second student fits in the first student's room once the
+    # first student leaves it.
+    headroom = thresh - room_stress_sum[student_one_room] \
+        + room_join_stress(student1, student_one_room, room_to_s, room_sizes,
+                           S, np.inf) \
+        + S[student1, student2]
+    if room_join_stress(student2, student_one_room, room_to_s, room_sizes, S,
+                        headroom) > headroom:
         return False
 
     return True
 
 
 
-def is_valid_move(student, room, D, rooms_to_s, k, G, s):
+@njit(cache=True)
+def is_valid_move(student, room, room_of, room_to_s, room_sizes,
+                  room_stress_sum, S, thresh, thresh_minus1):
     """
     Args:
         student: the student to be moved
         room: the room for the student to move to
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
-        rooms_to_s: Dictionary mapping breakout room to a list of
-        students currently in that room e.g. {0:[1, 2], 1:[0, 3]}
-        k: number of breakout rooms
-        G: networkx.Graph
-        s: stress budget
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+        S: Stress matrix
+        thresh: the most stress allowed in each room with the current
+        number of breakout rooms
+        thresh_minus1: the most stress allowed in each room with one fewer
+        breakout room
     Returns:
         bool: whether we can move the student to the room
     Notes:
@@ -319,7 +744,7 @@ def is_valid_move(student, room, D, rooms_to_s, k, G, s):
         guidleines.
     """
 
-    student_room = D[student]
+    student_room = room_of[student]
 
     # Check if we are trying to move the student to his own room.
     if student_room == room:
@@ -327,40 +752,40 @@ def is_valid_move(student, room, D, rooms_to_s, k, G, s):
 
     # Check if the student is alone in his current room.
     alone = False
-    if len(rooms_to_s[student_room]) == 1:
+    if room_sizes[student_room] == 1:
         alone = True
 
-    # Move the student to a copy of the new room.
-    student_moved = rooms_to_s[room].copy()
-    student_moved.append(student)
-
-    # Check if moving the student to the room was valid
     if alone:
-        max_stress = s / (k - 1)
-        if calculate_stress_for_room(student_moved, G) > max_stress:
-            return False
+        max_stress = thresh_minus1
     else:
-        max_stress = s / k
-        if calculate_stress_for_room(student_moved, G) > max_stress:
-            return False
+        max_stress = thresh
+
+    # Check if moving the student to the room was valid
+    headroom = max_stress - room_stress_sum[room]
+    if room_join_stress(student, room, room_to_s, room_sizes, S,
+                        headroom) > headroom:
+        return False
 
     return True
 
 
-def is_valid_move2(student1, student2, room1, room2, D, rooms_to_s, k, G, s):
+@njit(cache=True)
+def is_valid_move2(student1, student2, room1, room2, room_of, room_to_s,
+                   room_sizes, room_stress_sum, S, thresh_minus2):
     """
     Args:
         student1: the first student to be moved
         student2: the second student to be moved
         room1: the room for the first student to move to
         room2: the room for the second student to move to
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
-        rooms_to_s: Dictionary mapping breakout room to a list of
-        students currently in that room e.g. {0:[1, 2], 1:[0, 3]}
-        k: number of breakout rooms
-        G: networkx.Graph
-        s: stress budget
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+        S: Stress matrix
+        thresh_minus2: the most stress allowed in each room with two fewer
+        breakout rooms
     Returns:
         bool: whether we can move the students to the rooms
     Notes:
@@ -368,8 +793,18 @@ def is_valid_move2(student1, student2, room1, room2, D, rooms_to_s, k, G, s):
         guidleines.
     """
 
-    student1_room = D[student1]
-    student2_room = D[student2]
+    # Check if we are trying to move the same student twice.
+    if student1 == student2:
+        return False
+
+    student1_room = room_of[student1]
+    student2_room = room_of[student2]
+
+    # Check if we are trying to move a student into the other's room. That
+    # only empties one room, which is a single move (or a no-op swap), so
+    # the stress budget for two fewer rooms below would not apply.
+    if room1 == student2_room or room2 == student1_room:
+        return False
 
     # Check if we are trying to move student1 to his own room.
     if student1_room == room1:
@@ -380,11 +815,11 @@ def is_valid_move2(student1, student2, room1, room2, D, rooms_to_s, k, G, s):
         return False
 
     # Check if student1 is alone in his current room.
-    if len(rooms_to_s[student1_room]) != 1:
+    if room_sizes[student1_room] != 1:
         return False
 
     # Check if student2 is alone in his current room.
-    if len(rooms_to_s[student2_room]) != 1:
+    if room_sizes[student2_room] != 1:
         return False
 
     # Check if we are moving them to the same room.
@@ -393,152 +828,246 @@ def is_valid_move2(student1, student2, room1, room2, D, rooms_to_s, k, G, s):
         same_room = True
 
     if same_room:
-        students_moved = rooms_to_s[room1].copy()
-        students_moved.extend([student1, student2])
-        max_stress = s / (k - 2)
-        if calculate_stress_for_room(students_moved, G) > max_stress:
+        headroom = thresh_minus2 - room_stress_sum[room1] \
+            - S[student1, student2]
+        headroom -= room_join_stress(student1, room1, room_to_s, room_sizes,
+                                     S, headroom)
+        if headroom < 0:
+            return False
+        if room_join_stress(student2, room1, room_to_s, room_sizes, S,
+                            headroom) > headroom:
             return False
         return True
     else:
-        # Move student1 to a copy of their new room.
-        student1_moved = rooms_to_s[room1].copy()
-        student1_moved.append(student1)
-
-        # Move student2 to a copy of their new room.
-        student2_moved = rooms_to_s[room2].copy()
-        student2_moved.append(student2)
-
         # Check if moving the students to their new rooms was valid
-        max_stress = s / (k - 2)
-        if calculate_stress_for_room(student1_moved, G) > max_stress:
+        headroom = thresh_minus2 - room_stress_sum[room1]
+        if room_join_stress(student1, room1, room_to_s, room_sizes, S,
+                            headroom) > headroom:
             return False
-        if calculate_stress_for_room(student2_moved, G) > max_stress:
+        headroom = thresh_minus2 - room_stress_sum[room2]
+        if room_join_stress(student2, room2, room_to_s, room_sizes, S,
+                            headroom) > headroom:
             return False
 
         return True
 
 
-def swap_neighborhood(G, s, D, k):
+@njit(cache=True, parallel=True)
+def swap_neighborhood(S, s, room_of, room_to_s, room_sizes, room_stress_sum,
+                      k):
     """
     Args:
-        G: networkx.Graph
+        S: Stress matrix
         s: stress_budget
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
         k: Number of breakout rooms
     Returns:
-        valid_swaps: A 2D list corresponding to all valid student room swaps.
-        Each element of the list is a two element list. The
+        valid_swaps: An array corresponding to all valid student room swaps.
+        Each row of the array has two elements. The
         first element is a student and the second element is another student
-        whose room they can swap with. e.g. [[0, 1], [1,3]]
+        whose room they can swap with. e.g. [[0, 1], [1, 3]]
     Notes:
         This function determines all valid pairwise swaps given a mapping of
-        student to breakout room.
+        student to breakout room. The students are checked in parallel, each
+        one filling its own row of a mask which is then collected in order.
     """
 
-    num_students = len(G.nodes())
-    valid_swaps = []
-
-    # Create a dictionary which maps breakout room to a list of students who are
-    # currently in that room.
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
+    num_students = S.shape[0]
+    thresh = stress_threshold(s, k)
+    valid = np.zeros((num_students, num_students), dtype=np.bool_)
 
     # Loop through all the students and check which other student's they can
     # potentially swap rooms with.
-    for i in range(num_students):
-        j = i + 1
-        for j in range(num_students):
-            if is_valid_swap(i, j, D, room_to_s, k, G, s):
-                valid_swaps.append([i, j])
+    for i in prange(num_students):
+        for j in range(i + 1, num_students):
+            if is_valid_swap(i, j, room_of, room_to_s, room_sizes,
+                             room_stress_sum, S, thresh):
+                valid[i, j] = True
+
+    students1, students2 = np.nonzero(valid)
+    valid_swaps = np.empty((students1.shape[0], 2), dtype=np.int32)
+    valid_swaps[:, 0] = students1
+    valid_swaps[:, 1] = students2
 
     return valid_swaps
 
 
 
-def move_neighborhood(G, s, D, k):
+@njit(cache=True, parallel=True)
+def move_neighborhood(S, s, room_of, room_to_s, room_sizes, room_stress_sum,
+                      k, candidate_rooms):
     """
     Args:
-        G: networkx.Graph
+        S: Stress matrix
         s: stress_budget
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
         k: Number of breakout rooms
+        candidate_rooms: Boolean matrix of the rooms each student would
+        share more happiness with than their current room
     Returns:
-        valid_moves: A 2D list corresponding to all valid moves from the given
-        mapping D. Each element of the list is a two element list. The
+        valid_moves: An array corresponding to all valid moves from the given
+        mapping. Each row of the array has two elements. The
         first element is a student and the second element is a room they
-        can move to. e.g. [[0, 1], [1,3]]
+        can move to. e.g. [[0, 1], [1, 3]]
     Notes:
-        This function determines all valid single student room changes given
-        a mapping of students to breakout room.
+        This function determines all valid single student room changes into
+        candidate rooms given a mapping of students to breakout room. The
+        students are checked in parallel, each one filling its own row of a
+        mask which is then collected in order.
     """
 
-    num_students = len(G.nodes())
-    valid_moves = []
-    rooms_in_use = set(D.values())
-
-
-    # Create a dictionary which maps breakout room to a list of students who are
-    # currently in that room.
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
-
+    num_students = S.shape[0]
+    rooms_in_use = np.nonzero(room_sizes)[0]
+    thresh = stress_threshold(s, k)
+    thresh_minus1 = stress_threshold(s, k - 1)
+    valid = np.zeros((num_students, rooms_in_use.shape[0]), dtype=np.bool_)
 
     # Loop through all the students and check which rooms they can
     # potentially move to.
-    for student in range(num_students):
-        for room in rooms_in_use:
-            if is_valid_move(student, room, D, room_to_s, k, G, s):
-                valid_moves.append([student, room])
+    for student in prange(num_students):
+        for r in range(rooms_in_use.shape[0]):
+            if not candidate_rooms[student, rooms_in_use[r]]:
+                continue
+            if is_valid_move(student, rooms_in_use[r], room_of, room_to_s,
+                             room_sizes, room_stress_sum, S, thresh,
+                             thresh_minus1):
+                valid[student, r] = True
+
+    students, rooms = np.nonzero(valid)
+    valid_moves = np.empty((students.shape[0], 2), dtype=np.int32)
+    valid_moves[:, 0] = students
+    valid_moves[:, 1] = rooms_in_use[rooms]
 
     return valid_moves
 
 
-def move2_neighborhood(G, s, D, k):
+@njit(cache=True)
+def is_candidate_move2(student1, student2, room1, room2, candidate_rooms, H):
     """
     Args:
-        G: networkx.Graph
+        student1: the first student to be moved
+        student2: the second student to be moved
+        room1: the room for the first student to move to
+        room2: the room for the second student to move to
+        candidate_rooms: Boolean matrix of the rooms each student would
+        share more happiness with than their current room
+        H: Happiness matrix
+    Returns:
+        bool: whether the move can increase the happiness
+    Notes:
+        Both students are alone, so the move can only increase the happiness
+        if one of them moves into a candidate room or they move into the
+        same room and make each other happy.
+    """
+
+    if candidate_rooms[student1, room1] or candidate_rooms[student2, room2]:
+        return True
+
+    return room1 == room2 and H[student1, student2] > 0
+
+
+def move2_neighborhood(S, s, room_of, room_to_s, room_sizes, room_stress_sum,
+                       k, candidate_rooms, H):
+    """
+    Args:
+        S: Stress matrix
         s: stress_budget
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
         k: Number of breakout rooms
-    Returns:
-        valid_moves: A 2D list corresponding to all valid moves from the given
-        mapping D. Each element of the list is a two element list. The
-        first element is a student and the second element is a room they
-        can move to. e.g. [[0, 1], [1,3]]
+        candidate_rooms: Boolean matrix of the rooms each student would
+        share more happiness with than their current room
+        H: Happiness matrix
+    Yields:
+        valid_moves: An array of valid moves from the given mapping. Each
+        row of the array has four elements, the first student, the room
+        they can move to, the second student and the room they can move to.
+        e.g. [[0, 1, 2, 3]]
     Notes:
-        This function determines all valid two student room changes given
-        a mapping of students to breakout room.
+        This function lazily determines the valid two student room changes
+        given a mapping of students to breakout room, one first student at
+        a time, so a first improvement search can stop early. Moves which
+        cannot increase the happiness are skipped, see is_candidate_move2.
     """
 
-    num_students = len(G.nodes())
-    valid_moves = []
-    rooms_in_use = set(D.values())
+    rooms_in_use = np.nonzero(room_sizes)[0]
+    thresh_minus2 = stress_threshold(s, k - 2)
 
+    # Only students who are alone in their room can be moved together.
+    alone = np.nonzero(room_sizes[room_of] == 1)[0]
 
-    # Create a dictionary which maps breakout room to a list of students who are
-    # currently in that room.
-    room_to_s = {}
-    for m, v in D.items():
-        room_to_s.setdefault(v, []).append(m)
+    for i in range(alone.shape[0]):
+        yield move2_candidates(i, alone, rooms_in_use, room_of, room_to_s,
+                               room_sizes, room_stress_sum, S, thresh_minus2,
+                               candidate_rooms, H)
 
 
-    # Loop through all the students and check which rooms they can
-    # potentially move to.
-    for student1 in range(num_students):
-        student2 = student1 + 1
-        for student2 in range(num_students):
-            for room1 in rooms_in_use:
-                for room2 in rooms_in_use:
-                    if is_valid_move2(student1, student2, room1, room2, D,
-                                      room_to_s, k, G,
-                                      s):
-                        valid_moves.append([[student1, room1], [student2,
-                                                                room2]])
+@njit(cache=True, parallel=True)
+def move2_candidates(i, alone, rooms_in_use, room_of, room_to_s, room_sizes,
+                     room_stress_sum, S, thresh_minus2, candidate_rooms, H):
+    """
+    Args:
+        i: index into alone of the first student to be moved
+        alone: Array of the students who are alone in their room
+        rooms_in_use: Array of the breakout rooms with students in them
+        room_of: Array mapping student to breakout room r e.g. [2, 0, 1, 2]
+        room_to_s: Array where room_to_s[r, :room_sizes[r]] are the students
+        currently in breakout room r
+        room_sizes: Array of the number of students in each breakout room
+        room_stress_sum: Array of the stress inside each breakout room
+        S: Stress matrix
+        thresh_minus2: the most stress allowed in each room with two fewer
+        breakout rooms
+        candidate_rooms: Boolean matrix of the rooms each student would
+        share more happiness with than their current room
+        H: Happiness matrix
+    Returns:
+        valid_moves: An array corresponding to all valid two student moves
+        whose first student is alone[i], in the same format as
+        move2_neighborhood.
+    Notes:
+        The second students are checked in parallel, each one filling its
+        own slice of a mask which is then collected in order.
+    """
+
+    student1 = alone[i]
+    num_alone = alone.shape[0]
+    num_rooms = rooms_in_use.shape[0]
+    valid = np.zeros((num_alone, num_rooms, num_rooms), dtype=np.bool_)
+
+    # Loop through the later alone students and check which rooms the pair
+    # can potentially move to.
+    for j in prange(i + 1, num_alone):
+        student2 = alone[j]
+        for r1 in range(num_rooms):
+            room1 = rooms_in_use[r1]
+            for r2 in range(num_rooms):
+                room2 = rooms_in_use[r2]
+                if not is_candidate_move2(student1, student2, room1, room2,
+                                          candidate_rooms, H):
+                    continue
+                if is_valid_move2(student1, student2, room1, room2, room_of,
+                                  room_to_s, room_sizes, room_stress_sum, S,
+                                  thresh_minus2):
+                    valid[j, r1, r2] = True
+
+    second, rooms1, rooms2 = np.nonzero(valid)
+    valid_moves = np.empty((second.shape[0], 4), dtype=np.int32)
+    valid_moves[:, 0] = student1
+    valid_moves[:, 1] = rooms_in_use[rooms1]
+    valid_moves[:, 2] = alone[second]
+    valid_moves[:, 3] = rooms_in_use[rooms2]
 
     return valid_moves
 
@@ -549,8 +1078,8 @@ def swap(student1, student2, D):
     Args:
         student1: first student to be swapped
         student2: second student to be swapped
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
     Returns:
         Nothing
     Notes:
@@ -558,7 +1087,7 @@ def swap(student1, student2, D):
         room and the second student into the first student's room.
     """
 
-    D[student2], D[student1] = D[student2], D[student1]
+    D[student1], D[student2] = D[student2], D[student1]
 
     return
 
@@ -570,8 +1099,8 @@ def move(student, room, D):
     Args:
         student: the student to be moved
         room: the room the student will be moved into
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
     Returns:
         Nothing
     Notes:
@@ -590,8 +1119,8 @@ def move2(student1, student2, room1, room2, D):
         student2: the second student to be moved
         room1: the room the first student will be moved into
         room2: the room the first student will be moved into
-        D: Dictionary mapping for student to breakout room r e.g.
-        {0:2, 1:0, 2:1, 3:2}
+        D: Array mapping for student to breakout room r e.g.
+        [2, 0, 1, 2]
     Returns:
         Nothing
     Notes: